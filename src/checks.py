@@ -4,6 +4,7 @@ import glob
 import os
 import pathlib
 import re
+import shlex
 import shutil
 
 from typing import Tuple
@@ -27,6 +28,12 @@ MINIMUM_RMEM_MAX = 104857600
 MINIMUM_WMEM_MAX = 104857600
 MAX_CPU_SPEED_TEST_1_SECONDS = 3.5
 MAX_CPU_SPEED_TEST_2_SECONDS = 6.0
+MAX_PACKET_LOSS_PERCENT = 0.1
+
+# packet loss probe settings, bursts of back-to-back packets surface microburst drops
+PACKET_LOSS_PROBE_RATE = 10000
+PACKET_LOSS_PROBE_COUNT = 20000
+PACKET_LOSS_PROBE_BURST = 100
 
 
 def check_clock_synchronization() -> Tuple[bool, str, str]:
@@ -195,6 +202,43 @@ def check_wmem_max():
   return (True, output, None) if int(output) >= MINIMUM_WMEM_MAX else (False, output, "for best network performance, increase maximum socket send buffer size with `sysctl -w net.core.wmem_max=104857600`")
 
 
-def check_for_packet_loss():
-  # Can just ping 8.8.8.8 to start?
-  return (False, "not implemented", None)
+def check_for_packet_loss() -> Tuple[bool, str, str]:
+  # peers must be running `lib/bin/check_packet_loss echo` (UDP port 9797 by default), e.g.
+  # SUI_DOCTOR_PACKET_LOSS_PEERS="10.0.0.2:9797,10.0.0.3:9797"
+  # with no peers the prober forks its own echo responder on localhost, which
+  # does not exercise the NIC or the network so it can never pass the check
+  peers = [peer.strip() for peer in os.environ.get("SUI_DOCTOR_PACKET_LOSS_PEERS", "").split(",") if peer.strip()]
+
+  output = run_command("./check_packet_loss probe -r {} -n {} -b {} {}".format(
+    PACKET_LOSS_PROBE_RATE, PACKET_LOSS_PROBE_COUNT, PACKET_LOSS_PROBE_BURST,
+    " ".join(shlex.quote(peer) for peer in peers)), "lib/bin")
+
+  # the output ends with a summary across all peers:
+  # Total loss: 0.000%
+  # Total send errors: 0
+  # Total reordered: 0
+  # Unreachable peers: 0
+  # Worst loss: 0.000%
+  # Worst RTT p99: 48.2 us
+  #
+  # the summary is missing when no peer could be probed at all
+  if not re.search("^Worst loss:", output, re.MULTILINE):
+    return (False, output, "could not reach any packet loss peer")
+
+  unreachable_peers = parse_output(output, re.compile("Unreachable peers: ([0-9]+)", re.MULTILINE))
+  send_errors = parse_output(output, re.compile("Total send errors: ([0-9]+)", re.MULTILINE))
+  worst_loss = parse_output(output, re.compile("Worst loss: ([0-9.]+)%", re.MULTILINE))
+
+  if unreachable_peers > 0:
+    return (False, output, "could not reach {} packet loss peer(s), check SUI_DOCTOR_PACKET_LOSS_PEERS".format(int(unreachable_peers)))
+
+  if send_errors > 0:
+    return (False, output, "{} probes could not be sent, the local socket send buffer overflowed, increase it with `sysctl -w net.core.wmem_max=104857600`".format(int(send_errors)))
+
+  if worst_loss > MAX_PACKET_LOSS_PERCENT:
+    return (False, output, "packet loss to every peer must be at most {}%, check socket buffer sizes (rmem_max/wmem_max) and NIC ring buffers".format(MAX_PACKET_LOSS_PERCENT))
+
+  if not peers:
+    return (False, output, "only loopback was probed, run `lib/bin/check_packet_loss echo` on other machines and list them in SUI_DOCTOR_PACKET_LOSS_PEERS")
+
+  return (True, output, None)
@@ -0,0 +1,596 @@
+/*
+ * UDP latency and packet loss prober.
+ *
+ * Sends timestamped UDP probes at a fixed rate (optionally in back-to-back
+ * bursts) to one or more peers running the built-in echo responder, then
+ * reports loss, reordering, duplicates and an RTT histogram per peer.
+ * Needs no root, unlike ICMP ping.
+ *
+ * Usage:
+ *   check_packet_loss echo [-p port]
+ *   check_packet_loss probe [-r rate] [-n count] [-b burst] [-s size]
+ *                           [-t timeout_ms] [host:port ...]
+ *
+ * When probe is given no peers it forks an echo responder on 127.0.0.1 and
+ * probes that, which exercises the local network stack and socket buffers.
+ *
+ * Replies are timestamped by the kernel (SO_TIMESTAMPNS) so RTTs do not
+ * include the time the prober spends sending the rest of a burst or sleeping.
+ */
+
+#define _GNU_SOURCE
+
+#include <errno.h>
+#include <netdb.h>
+#include <netinet/in.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/prctl.h>
+#include <sys/socket.h>
+#include <sys/uio.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+#include <arpa/inet.h>
+#include <fcntl.h>
+
+#define DEFAULT_PORT 9797
+#define DEFAULT_RATE 10000
+#define DEFAULT_COUNT 20000
+#define DEFAULT_BURST 100
+#define DEFAULT_SIZE 64
+#define DEFAULT_TIMEOUT_MS 1000
+#define MAX_SIZE 1472
+#define SOCKET_BUFFER_SIZE (8 * 1024 * 1024)
+#define PROBE_MAGIC 0x53444f43u /* "SDOC" */
+#define PROBE_FLAG_REPLY 0x1u
+#define HISTOGRAM_BUCKETS 32
+
+struct probe {
+    uint32_t magic;
+    uint32_t nonce;
+    uint32_t seq;
+    uint32_t flags;
+    uint64_t send_ns;
+};
+
+struct peer_stats {
+    uint64_t sent;
+    uint64_t send_errors;
+    uint64_t received;
+    uint64_t reordered;
+    uint64_t duplicates;
+    int64_t highest_seq;
+    uint8_t *seen;
+    uint64_t *rtts_ns;
+};
+
+static uint64_t now_ns(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000ull + (uint64_t)ts.tv_nsec;
+}
+
+static uint64_t realtime_ns(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_REALTIME, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000ull + (uint64_t)ts.tv_nsec;
+}
+
+static const char *prog = "check_packet_loss";
+
+static void usage(void)
+{
+    fprintf(stderr,
+            "usage: %s echo [-p port]\n"
+            "       %s probe [-r rate] [-n count] [-b burst] [-s size] [-t timeout_ms] [host:port ...]\n",
+            prog, prog);
+    exit(2);
+}
+
+static void set_buffers(int fd)
+{
+    int size = SOCKET_BUFFER_SIZE;
+    /* the kernel silently caps these at net.core.{r,w}mem_max */
+    setsockopt(fd, SOL_SOCKET, SO_RCVBUF, &size, sizeof(size));
+    setsockopt(fd, SOL_SOCKET, SO_SNDBUF, &size, sizeof(size));
+}
+
+static void echo_loop(int fd)
+{
+    char buf[65536];
+    struct sockaddr_storage from;
+
+    for (;;) {
+        socklen_t fromlen = sizeof(from);
+        ssize_t n = recvfrom(fd, buf, sizeof(buf), 0, (struct sockaddr *)&from, &fromlen);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            perror("recvfrom");
+            exit(1);
+        }
+
+        /*
+         * only answer our own probes and never answer a reply, otherwise two
+         * responders could bounce a spoofed packet between each other forever
+         */
+        struct probe p;
+        if ((size_t)n < sizeof(p))
+            continue;
+        memcpy(&p, buf, sizeof(p));
+        if (p.magic != PROBE_MAGIC || (p.flags & PROBE_FLAG_REPLY))
+            continue;
+
+        p.flags |= PROBE_FLAG_REPLY;
+        memcpy(buf, &p, sizeof(p));
+        sendto(fd, buf, n, 0, (struct sockaddr *)&from, fromlen);
+    }
+}
+
+static int run_echo(int argc, char **argv)
+{
+    int port = DEFAULT_PORT;
+    int opt;
+
+    while ((opt = getopt(argc, argv, "p:")) != -1) {
+        switch (opt) {
+        case 'p':
+            port = atoi(optarg);
+            break;
+        default:
+            usage();
+        }
+    }
+
+    /* prefer a dual-stack socket, fall back to IPv4 only */
+    int fd = socket(AF_INET6, SOCK_DGRAM, 0);
+    if (fd >= 0) {
+        int off = 0;
+        struct sockaddr_in6 addr = {0};
+        setsockopt(fd, IPPROTO_IPV6, IPV6_V6ONLY, &off, sizeof(off));
+        addr.sin6_family = AF_INET6;
+        addr.sin6_addr = in6addr_any;
+        addr.sin6_port = htons(port);
+        if (bind(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+            close(fd);
+            fd = -1;
+        }
+    }
+    if (fd < 0) {
+        struct sockaddr_in addr = {0};
+        fd = socket(AF_INET, SOCK_DGRAM, 0);
+        addr.sin_family = AF_INET;
+        addr.sin_addr.s_addr = htonl(INADDR_ANY);
+        addr.sin_port = htons(port);
+        if (fd < 0 || bind(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+            perror("bind");
+            return 1;
+        }
+    }
+
+    set_buffers(fd);
+    printf("Echo responder listening on UDP port %d\n", port);
+    fflush(stdout);
+    echo_loop(fd);
+    return 0;
+}
+
+/* split "host:port" or "[v6addr]:port" and return a connected UDP socket */
+static int connect_peer(const char *peer)
+{
+    char host[256];
+    const char *colon = strrchr(peer, ':');
+    if (!colon || colon == peer || (size_t)(colon - peer) >= sizeof(host)) {
+        fprintf(stderr, "invalid peer '%s', expected host:port\n", peer);
+        return -1;
+    }
+
+    const char *start = peer;
+    size_t len = colon - peer;
+    if (peer[0] == '[' && colon[-1] == ']') {
+        start++;
+        len -= 2;
+    }
+    memcpy(host, start, len);
+    host[len] = '\0';
+
+    struct addrinfo hints = {0}, *res, *ai;
+    hints.ai_family = AF_UNSPEC;
+    hints.ai_socktype = SOCK_DGRAM;
+    int rc = getaddrinfo(host, colon + 1, &hints, &res);
+    if (rc != 0) {
+        fprintf(stderr, "could not resolve '%s': %s\n", peer, gai_strerror(rc));
+        return -1;
+    }
+
+    int fd = -1;
+    for (ai = res; ai; ai = ai->ai_next) {
+        fd = socket(ai->ai_family, ai->ai_socktype, ai->ai_protocol);
+        if (fd < 0)
+            continue;
+        if (connect(fd, ai->ai_addr, ai->ai_addrlen) == 0)
+            break;
+        close(fd);
+        fd = -1;
+    }
+    freeaddrinfo(res);
+
+    if (fd < 0) {
+        fprintf(stderr, "could not connect to '%s'\n", peer);
+        return -1;
+    }
+
+    int on = 1;
+    set_buffers(fd);
+    setsockopt(fd, SOL_SOCKET, SO_TIMESTAMPNS, &on, sizeof(on));
+    fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | O_NONBLOCK);
+    return fd;
+}
+
+static void drain(int fd, uint32_t nonce, uint64_t count, struct peer_stats *st)
+{
+    char buf[65536];
+    char control[CMSG_SPACE(sizeof(struct timespec))];
+
+    /* kernel timestamps are CLOCK_REALTIME, probes carry CLOCK_MONOTONIC */
+    uint64_t realtime_offset = realtime_ns() - now_ns();
+
+    for (;;) {
+        struct iovec iov = {buf, sizeof(buf)};
+        struct msghdr msg = {0};
+        msg.msg_iov = &iov;
+        msg.msg_iovlen = 1;
+        msg.msg_control = control;
+        msg.msg_controllen = sizeof(control);
+
+        ssize_t n = recvmsg(fd, &msg, 0);
+        if (n < 0) {
+            /* ECONNREFUSED means an ICMP port unreachable came back, keep going */
+            if (errno == EINTR || errno == ECONNREFUSED)
+                continue;
+            return;
+        }
+
+        uint64_t received_ns = now_ns();
+        for (struct cmsghdr *cmsg = CMSG_FIRSTHDR(&msg); cmsg; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+            if (cmsg->cmsg_level == SOL_SOCKET && cmsg->cmsg_type == SCM_TIMESTAMPNS) {
+                struct timespec ts;
+                memcpy(&ts, CMSG_DATA(cmsg), sizeof(ts));
+                received_ns = (uint64_t)ts.tv_sec * 1000000000ull + (uint64_t)ts.tv_nsec - realtime_offset;
+            }
+        }
+
+        struct probe p;
+        if ((size_t)n < sizeof(p))
+            continue;
+        memcpy(&p, buf, sizeof(p));
+        if (p.magic != PROBE_MAGIC || !(p.flags & PROBE_FLAG_REPLY) ||
+            p.nonce != nonce || p.seq >= count)
+            continue;
+
+        if (st->seen[p.seq]) {
+            st->duplicates++;
+            continue;
+        }
+        st->seen[p.seq] = 1;
+        st->rtts_ns[st->received++] = received_ns - p.send_ns;
+
+        if ((int64_t)p.seq < st->highest_seq)
+            st->reordered++;
+        else
+            st->highest_seq = p.seq;
+    }
+}
+
+/*
+ * a pending ICMP error from an earlier probe is reported by the next send and
+ * that packet is not sent, retry once since reporting the error clears it
+ */
+static int send_probe(int fd, const char *buf, size_t size)
+{
+    for (int attempt = 0; attempt < 2; attempt++) {
+        if (send(fd, buf, size, 0) >= 0)
+            return 0;
+        if (errno != ECONNREFUSED && errno != EINTR)
+            return -1;
+    }
+    return -1;
+}
+
+static int compare_u64(const void *a, const void *b)
+{
+    uint64_t x = *(const uint64_t *)a, y = *(const uint64_t *)b;
+    return (x > y) - (x < y);
+}
+
+/* nearest-rank percentile of a sorted array */
+static double percentile_us(const uint64_t *sorted, uint64_t n, int pct)
+{
+    if (n == 0)
+        return 0.0;
+    uint64_t rank = (n * pct + 99) / 100;
+    if (rank == 0)
+        rank = 1;
+    return sorted[rank - 1] / 1000.0;
+}
+
+static void print_histogram(const uint64_t *rtts_ns, uint64_t n)
+{
+    uint64_t buckets[HISTOGRAM_BUCKETS] = {0};
+    int lo = HISTOGRAM_BUCKETS, hi = -1;
+
+    /* bucket i holds RTTs in [2^i, 2^(i+1)) microseconds, bucket 0 also holds < 1 us */
+    for (uint64_t i = 0; i < n; i++) {
+        uint64_t us = rtts_ns[i] / 1000;
+        int b = 0;
+        while (us > 1 && b < HISTOGRAM_BUCKETS - 1) {
+            us >>= 1;
+            b++;
+        }
+        buckets[b]++;
+        if (b < lo)
+            lo = b;
+        if (b > hi)
+            hi = b;
+    }
+
+    printf("RTT histogram:\n");
+    for (int b = lo; b <= hi; b++) {
+        int width = (int)(buckets[b] * 50 / n);
+        printf("  %8llu - %8llu us: %8llu ",
+               b == 0 ? 0ull : 1ull << b, (1ull << (b + 1)) - 1,
+               (unsigned long long)buckets[b]);
+        for (int i = 0; i < width; i++)
+            putchar('#');
+        putchar('\n');
+    }
+}
+
+static int probe_peer(const char *peer, uint64_t rate, uint64_t count, uint64_t burst,
+                      size_t size, int timeout_ms, struct peer_stats *st)
+{
+    int fd = connect_peer(peer);
+    if (fd < 0)
+        return -1;
+
+    char buf[MAX_SIZE] = {0};
+    uint32_t nonce = (uint32_t)(now_ns() ^ getpid());
+    uint64_t burst_interval_ns = burst * 1000000000ull / rate;
+    uint64_t start = now_ns();
+
+    memset(st, 0, sizeof(*st));
+    st->highest_seq = -1;
+    st->seen = calloc(count, 1);
+    st->rtts_ns = calloc(count, sizeof(uint64_t));
+    if (!st->seen || !st->rtts_ns) {
+        perror("calloc");
+        exit(1);
+    }
+
+    for (uint64_t seq = 0; seq < count; ) {
+        uint64_t deadline = start + (seq / burst) * burst_interval_ns;
+
+        while (now_ns() < deadline) {
+            drain(fd, nonce, count, st);
+            uint64_t remaining = deadline - now_ns();
+            if ((int64_t)remaining > 50000)
+                remaining = 50000;
+            if ((int64_t)remaining > 0) {
+                struct timespec ts = {0, (long)remaining};
+                nanosleep(&ts, NULL);
+            }
+        }
+
+        for (uint64_t i = 0; i < burst && seq < count; i++, seq++) {
+            struct probe p = {PROBE_MAGIC, nonce, (uint32_t)seq, 0, now_ns()};
+            memcpy(buf, &p, sizeof(p));
+            st->sent++;
+            /* a full send buffer is a local drop, it is reported apart from network loss */
+            if (send_probe(fd, buf, size) < 0)
+                st->send_errors++;
+        }
+        drain(fd, nonce, count, st);
+    }
+
+    /* wait for stragglers */
+    uint64_t wait_until = now_ns() + (uint64_t)timeout_ms * 1000000ull;
+    while (st->received < st->sent - st->send_errors && now_ns() < wait_until) {
+        struct pollfd pfd = {fd, POLLIN, 0};
+        int remaining_ms = (int)((wait_until - now_ns()) / 1000000ull) + 1;
+        if (poll(&pfd, 1, remaining_ms) > 0)
+            drain(fd, nonce, count, st);
+    }
+
+    close(fd);
+    return 0;
+}
+
+/* loss is counted over the probes that actually left this host */
+static double loss_percent(uint64_t sent, uint64_t send_errors, uint64_t received)
+{
+    uint64_t on_wire = sent - send_errors;
+    return on_wire ? 100.0 * (on_wire - received) / on_wire : 0.0;
+}
+
+static void report_peer(const char *peer, const struct peer_stats *st)
+{
+    uint64_t lost = st->sent - st->send_errors - st->received;
+    double loss_pct = loss_percent(st->sent, st->send_errors, st->received);
+
+    printf("Peer: %s\n", peer);
+    printf("Sent: %llu\n", (unsigned long long)st->sent);
+    printf("Send errors: %llu\n", (unsigned long long)st->send_errors);
+    printf("Received: %llu\n", (unsigned long long)st->received);
+    printf("Lost: %llu (%.3f%%)\n", (unsigned long long)lost, loss_pct);
+    printf("Reordered: %llu\n", (unsigned long long)st->reordered);
+    printf("Duplicates: %llu\n", (unsigned long long)st->duplicates);
+
+    if (st->received == 0) {
+        printf("RTT: no replies\n\n");
+        return;
+    }
+
+    printf("RTT p50: %.1f us\n", percentile_us(st->rtts_ns, st->received, 50));
+    printf("RTT p99: %.1f us\n", percentile_us(st->rtts_ns, st->received, 99));
+    printf("RTT max: %.1f us\n", st->rtts_ns[st->received - 1] / 1000.0);
+    print_histogram(st->rtts_ns, st->received);
+    printf("\n");
+}
+
+static pid_t spawn_loopback_echo(char *peer, size_t peer_len)
+{
+    struct sockaddr_in addr = {0};
+    socklen_t addrlen = sizeof(addr);
+    int fd = socket(AF_INET, SOCK_DGRAM, 0);
+
+    addr.sin_family = AF_INET;
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    addr.sin_port = 0;
+    if (fd < 0 || bind(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0 ||
+        getsockname(fd, (struct sockaddr *)&addr, &addrlen) < 0) {
+        perror("bind");
+        exit(1);
+    }
+    set_buffers(fd);
+    snprintf(peer, peer_len, "127.0.0.1:%d", ntohs(addr.sin_port));
+
+    fflush(stdout);
+    pid_t parent = getpid();
+    pid_t pid = fork();
+    if (pid < 0) {
+        perror("fork");
+        exit(1);
+    }
+    if (pid == 0) {
+        /* don't outlive the prober if it exits early */
+        prctl(PR_SET_PDEATHSIG, SIGTERM);
+        if (getppid() != parent)
+            exit(0);
+        echo_loop(fd);
+    }
+
+    close(fd);
+    return pid;
+}
+
+static int run_probe(int argc, char **argv)
+{
+    uint64_t rate = DEFAULT_RATE, count = DEFAULT_COUNT, burst = DEFAULT_BURST;
+    size_t size = DEFAULT_SIZE;
+    int timeout_ms = DEFAULT_TIMEOUT_MS;
+    int opt;
+
+    while ((opt = getopt(argc, argv, "r:n:b:s:t:")) != -1) {
+        switch (opt) {
+        case 'r':
+            rate = strtoull(optarg, NULL, 10);
+            break;
+        case 'n':
+            count = strtoull(optarg, NULL, 10);
+            break;
+        case 'b':
+            burst = strtoull(optarg, NULL, 10);
+            break;
+        case 's':
+            size = strtoul(optarg, NULL, 10);
+            break;
+        case 't':
+            timeout_ms = atoi(optarg);
+            break;
+        default:
+            usage();
+        }
+    }
+
+    if (rate == 0 || count == 0 || burst == 0 || count > UINT32_MAX ||
+        size < sizeof(struct probe) || size > MAX_SIZE || timeout_ms < 0) {
+        fprintf(stderr, "invalid arguments: rate, count and burst must be positive, "
+                        "size must be between %zu and %d\n", sizeof(struct probe), MAX_SIZE);
+        return 2;
+    }
+
+    char loopback_peer[64];
+    char *loopback_argv[] = {loopback_peer};
+    char **peers = argv + optind;
+    int num_peers = argc - optind;
+    pid_t echo_pid = 0;
+
+    if (num_peers == 0) {
+        echo_pid = spawn_loopback_echo(loopback_peer, sizeof(loopback_peer));
+        peers = loopback_argv;
+        num_peers = 1;
+    }
+
+    printf("Probing %d peer(s): %llu packets of %zu bytes at %llu pps in bursts of %llu\n\n",
+           num_peers, (unsigned long long)count, size, (unsigned long long)rate,
+           (unsigned long long)burst);
+
+    uint64_t total_sent = 0, total_send_errors = 0, total_received = 0, total_reordered = 0;
+    double worst_loss = 0.0, worst_p99 = 0.0;
+    int unreachable = 0;
+
+    for (int i = 0; i < num_peers; i++) {
+        struct peer_stats st;
+        if (probe_peer(peers[i], rate, count, burst, size, timeout_ms, &st) < 0) {
+            unreachable++;
+            continue;
+        }
+
+        qsort(st.rtts_ns, st.received, sizeof(uint64_t), compare_u64);
+        report_peer(peers[i], &st);
+
+        total_sent += st.sent;
+        total_send_errors += st.send_errors;
+        total_received += st.received;
+        total_reordered += st.reordered;
+        double loss = loss_percent(st.sent, st.send_errors, st.received);
+        if (loss > worst_loss)
+            worst_loss = loss;
+        double p99 = percentile_us(st.rtts_ns, st.received, 99);
+        if (p99 > worst_p99)
+            worst_p99 = p99;
+
+        free(st.seen);
+        free(st.rtts_ns);
+    }
+
+    if (echo_pid > 0) {
+        kill(echo_pid, SIGTERM);
+        waitpid(echo_pid, NULL, 0);
+    }
+
+    if (total_sent == 0)
+        return 1;
+
+    printf("Total loss: %.3f%%\n", loss_percent(total_sent, total_send_errors, total_received));
+    printf("Total send errors: %llu\n", (unsigned long long)total_send_errors);
+    printf("Total reordered: %llu\n", (unsigned long long)total_reordered);
+    printf("Unreachable peers: %d\n", unreachable);
+    printf("Worst loss: %.3f%%\n", worst_loss);
+    printf("Worst RTT p99: %.1f us\n", worst_p99);
+    return unreachable ? 1 : 0;
+}
+
+int main(int argc, char **argv)
+{
+    prog = argv[0];
+    if (argc < 2)
+        usage();
+
+    /* let getopt see the subcommand as argv[0] */
+    if (strcmp(argv[1], "echo") == 0)
+        return run_echo(argc - 1, argv + 1);
+    if (strcmp(argv[1], "probe") == 0)
+        return run_probe(argc - 1, argv + 1);
+
+    usage();
+    return 2;
+}
@@ -45,7 +45,7 @@ commands = [
     check_storage_space_for_suidb,
     check_rmem_max,
     check_wmem_max,
-    # check_for_packet_loss,
+    check_for_packet_loss,
     check_cpu_governor
 ]
 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# end-to-end tests for lib/src/check_packet_loss.c and check_for_packet_loss,
+# run with `python -m pytest` from this directory
+
+import re
+import socket
+import struct
+import subprocess
+import time
+
+import pytest
+
+from checks import check_for_packet_loss
+from utils import script_dir
+
+
+BINARY = script_dir() / "lib" / "bin" / "check_packet_loss"
+
+# struct probe: magic, nonce, seq, flags, send_ns
+PROBE_FORMAT = "=IIIIQ"
+PROBE_MAGIC = 0x53444f43
+PROBE_FLAG_REPLY = 0x1
+
+
+@pytest.fixture(scope="module", autouse=True)
+def build_tools():
+  subprocess.run("make", cwd=script_dir() / "lib", check=True, capture_output=True)
+
+
+@pytest.fixture(autouse=True)
+def isolate(tmp_path, monkeypatch):
+  # run_command logs invocations to the current directory
+  monkeypatch.chdir(tmp_path)
+  monkeypatch.delenv("SUI_DOCTOR_PACKET_LOSS_PEERS", raising=False)
+
+
+def free_udp_port():
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+@pytest.fixture
+def echo_responder():
+  port = free_udp_port()
+  process = subprocess.Popen([str(BINARY), "echo", "-p", str(port)], stdout=subprocess.PIPE)
+  process.stdout.readline()  # wait for "Echo responder listening..."
+  yield port
+  process.terminate()
+  process.wait()
+
+
+def test_loopback_output_format():
+  output = subprocess.run([str(BINARY), "probe", "-n", "2000"], check=True,
+                          capture_output=True, encoding="utf-8").stdout
+
+  # the lines check_for_packet_loss and operators rely on
+  for pattern in [
+      "^Sent: 2000$",
+      "^Lost: [0-9]+ \\([0-9.]+%\\)$",
+      "^RTT p50: [0-9.]+ us$",
+      "^RTT p99: [0-9.]+ us$",
+      "^RTT max: [0-9.]+ us$",
+      "^RTT histogram:$",
+      "^ +[0-9]+ - +[0-9]+ us: +[0-9]+ #*$",
+      "^Total loss: [0-9.]+%$",
+      "^Total send errors: 0$",
+      "^Unreachable peers: 0$",
+      "^Worst loss: [0-9.]+%$",
+      "^Worst RTT p99: [0-9.]+ us$",
+  ]:
+    assert re.search(pattern, output, re.MULTILINE), pattern
+
+
+def test_loopback_rtt_is_not_inflated_by_the_prober():
+  # without bursts the RTT is a plain loopback round trip, tens of microseconds
+  output = subprocess.run([str(BINARY), "probe", "-b", "1", "-r", "1000", "-n", "2000"], check=True,
+                          capture_output=True, encoding="utf-8").stdout
+
+  p50 = float(re.search("^RTT p50: ([0-9.]+) us$", output, re.MULTILINE).group(1))
+  assert 0 < p50 < 100, output
+
+
+def test_check_does_not_pass_on_loopback_only():
+  (status, output, detail) = check_for_packet_loss()
+  assert not status
+  assert "Worst loss: 0.000%" in output
+  assert "only loopback was probed" in detail
+  assert "SUI_DOCTOR_PACKET_LOSS_PEERS" in detail
+
+
+def test_check_passes_against_echo_responder(monkeypatch, echo_responder):
+  monkeypatch.setenv("SUI_DOCTOR_PACKET_LOSS_PEERS", f"127.0.0.1:{echo_responder}, localhost:{echo_responder}")
+  (status, output, detail) = check_for_packet_loss()
+  assert status, output
+  assert output.count("Peer: ") == 2
+
+
+def test_check_fails_when_no_peer_is_reachable(monkeypatch):
+  monkeypatch.setenv("SUI_DOCTOR_PACKET_LOSS_PEERS", "nosuchhost.invalid:1")
+  (status, output, detail) = check_for_packet_loss()
+  assert not status
+  assert detail == "could not reach any packet loss peer"
+
+
+def test_check_fails_when_some_peer_is_unreachable(monkeypatch, echo_responder):
+  monkeypatch.setenv("SUI_DOCTOR_PACKET_LOSS_PEERS", f"127.0.0.1:{echo_responder},nosuchhost.invalid:1")
+  (status, output, detail) = check_for_packet_loss()
+  assert not status
+  assert "could not reach 1 packet loss peer" in detail
+
+
+def test_check_fails_on_lossy_peer(monkeypatch, echo_responder):
+  # nothing listens on the second port, so every probe to it is lost
+  monkeypatch.setenv("SUI_DOCTOR_PACKET_LOSS_PEERS", f"127.0.0.1:{echo_responder},127.0.0.1:{free_udp_port()}")
+  (status, output, detail) = check_for_packet_loss()
+  assert not status
+  assert "Worst loss: 100.000%" in output
+  # the resulting ICMP errors are network loss, not local send errors
+  assert "Total send errors: 0" in output
+  assert detail.startswith("packet loss to every peer")
+
+
+def test_check_quotes_peers(monkeypatch, tmp_path):
+  injected = tmp_path / "injected"
+  monkeypatch.setenv("SUI_DOCTOR_PACKET_LOSS_PEERS", f"localhost:1;touch {injected}")
+  (status, output, detail) = check_for_packet_loss()
+  assert not status
+  assert not injected.exists()
+
+
+def test_echo_responder_only_answers_probes(echo_responder):
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+    sock.settimeout(0.3)
+    sock.connect(("127.0.0.1", echo_responder))
+
+    # arbitrary payloads and replies must not be echoed
+    sock.send(b"hello")
+    sock.send(struct.pack(PROBE_FORMAT, PROBE_MAGIC, 1, 0, PROBE_FLAG_REPLY, time.monotonic_ns()))
+    with pytest.raises(socket.timeout):
+      sock.recv(1024)
+
+    sock.send(struct.pack(PROBE_FORMAT, PROBE_MAGIC, 1, 7, 0, 42))
+    (magic, nonce, seq, flags, send_ns) = struct.unpack(PROBE_FORMAT, sock.recv(1024))
+    assert (magic, nonce, seq, flags, send_ns) == (PROBE_MAGIC, 1, 7, PROBE_FLAG_REPLY, 42)